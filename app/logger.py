@@ -2,7 +2,7 @@ import os
 
 from loguru import logger
 
-from config import LOG_DIR
+from config import LOG_DIR, LOG_LEVEL
 
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
@@ -15,7 +15,6 @@ logger.add(
         compression="zip",
         retention="10 days",
         format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}",
-        # level="INFO",
-        level="DEBUG",  # DEBUG MODE
-
+        level=LOG_LEVEL,  # Задаётся переменной окружения LOG_LEVEL, по умолчанию INFO
+        enqueue=True,  # Запись в файл в фоновом потоке, не блокирует event loop
 )
@@ -1,17 +1,19 @@
 import asyncio
-from datetime import datetime, timedelta
+import time
 
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait, InputUserDeactivated, UserDeactivated, UserIsBlocked
 from pyrogram.types import Message
 
 from app.schemas.sent_messages import SentMessageSchema
 from app.schemas.status import Status
 from app.schemas.users import UserSchema
 from app.logger import logger
-from config import API_ID, API_HASH, API_NAME, TRIGGER_WORDS, MESSAGES
+from app.utils import TokenBucket, utcnow
+from config import API_ID, API_HASH, API_NAME, TRIGGER_RE, MESSAGES, THIRD_DELAY
 from data.methods.sent_messages import SentMessageRepository
 from data.methods.users import UserRepository
-from data.models.models import SentMessage
+from data.models.models import AsyncSessionLocal, SentMessage
 
 
 app = Client(name=API_NAME,
@@ -19,110 +21,203 @@ app = Client(name=API_NAME,
              api_hash=API_HASH,
              workdir="sessions")
 
+ALIVE_CACHE_TTL = 300  # Период полного обновления кэша активных пользователей из БД, сек
+MIN_TICK_SLEEP = 1.0  # Минимальная пауза между тиками рассылки, сек
+MAX_TICK_SLEEP = 60.0  # Максимальная пауза между тиками рассылки, сек
+SEND_CONCURRENCY = 20  # Максимум одновременных отправок (с запасом до лимитов Telegram ~30/с)
+SEND_RATE_LIMIT = 25  # Глобальный лимит исходящих сообщений в секунду
 
-async def send_message(user_id: int, text: str) -> None:
+_send_semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+_send_bucket = TokenBucket(SEND_RATE_LIMIT)
+
+# Строковые значения статусов, чтобы не обращаться к enum на каждое сообщение
+ALIVE = Status.alive.value
+DEAD = Status.dead.value
+FINISHED = Status.finished.value
+
+_alive_cache: set[int] = set()
+_alive_cache_ts: float | None = None
+
+
+async def _refresh_alive_cache(session=None) -> None:
+    """
+        Асинхронно обновляет кэш активных пользователей из базы данных.
+
+        Кэш поддерживается инкрементально при изменении статусов (dead, finished, новый пользователь),
+        а полное обновление из БД выполняется раз в ALIVE_CACHE_TTL секунд.
+
+        Набор изменяется на месте, а не пересоздается: пользователи, добавленные
+        конкурентно во время запроса, не теряются. Удаляются только id, известные
+        до запроса и отсутствующие в его результате.
+    """
+    global _alive_cache_ts
+    known_before = set(_alive_cache)
+    alive_ids = set(await UserRepository.get_all_alive_ids(session=session))
+    _alive_cache -= known_before - alive_ids
+    _alive_cache |= alive_ids
+    _alive_cache_ts = time.monotonic()
+    logger.debug("Alive cache refreshed: {} users.", len(_alive_cache))
+
+
+async def send_message(user_id: int, text: str, session=None) -> bool:
     """
         Асинхронно отправляет текстовое сообщение пользователю.
-    
+
         Параметры:
         - user_id (int): id пользователя, которому будет отправлено сообщение.
         - text (str): Текст сообщения для отправки.
-    
-        При срабатывании исключения, обновляет статус пользователя на 'dead'. Например, UserDeactivated.
+        - session (AsyncSession | None): Внешняя сессия БД или None.
+
+        Возвращает:
+        - bool: True, если сообщение доставлено, иначе False.
+
+        FloodWait обрабатывается ожиданием и повтором; статус 'dead' выставляется только
+        когда пользователь действительно недоступен (блокировка или деактивация).
+        При прочих ошибках сообщение остается ожидающим и будет повторено на следующем тике.
     """
     try:
+        await _send_bucket.acquire()
         await app.send_message(user_id, text)
         logger.info(f"Message sent to user {user_id}: {text}")
+        return True
+    except FloodWait as e:
+        logger.warning(f"FloodWait while sending to user {user_id}, sleeping {e.value}s and retrying.")
+        await asyncio.sleep(e.value)
+        return await send_message(user_id, text, session=session)
+    except (UserIsBlocked, UserDeactivated, InputUserDeactivated) as e:
+        _alive_cache.discard(user_id)
+        await UserRepository.update_user(UserSchema(user_id=user_id, status=DEAD), session=session)
+        await SentMessageRepository.mark_all_unavailable(user_id, session=session)
+        logger.error(f"User {user_id} is unreachable, marked as dead: {e}")
+        return False
     except Exception as e:
-        await UserRepository.update_user(UserSchema(user_id=user_id, status=Status.dead.value))
         logger.error(f"An error occurred while sending a message to user {user_id}: {e}")
+        return False
+
+
+async def _dispatch_message(user_id: int, index: int, message_text: str) -> None:
+    """
+        Асинхронно отправляет одно сообщение пользователю и обновляет статусы в БД.
+
+        Ограничивается семафором _send_semaphore, чтобы не превышать лимиты Telegram.
+        Открывает собственные сессии БД: общую сессию тика нельзя использовать
+        из нескольких конкурентных задач.
+
+        Статусы обновляются только при успешной отправке: неотправленное сообщение
+        остается ожидающим, а пользователь, помеченный как dead, не переводится в finished.
+
+        Параметры:
+        - user_id (int): id пользователя, которому отправляется сообщение.
+        - index (int): Индекс сообщения в цепочке.
+        - message_text (str): Текст сообщения.
+    """
+    async with _send_semaphore:
+        sent = await send_message(user_id, message_text)
+        if not sent:
+            return
+        await SentMessageRepository.update_status(
+                user_id, index, is_sent=True, is_available_sent=True
+        )
+        logger.info(
+                f"Sent message index {index} to user {user_id},"
+                f" message_text: {message_text}")
+        if index == 3:
+            _alive_cache.discard(user_id)
+            await UserRepository.update_user(UserSchema(user_id=user_id, status=FINISHED))
+            logger.info(f"User {user_id} finished.")
 
 
 async def send_messages_loop() -> None:
     """
-        Асинхронный бесконечный цикл, который каждую минуту проверяет наличие активных пользователей
-        и отправляет им ожидающие сообщения.
-    
-        Для каждого активного пользователя функция ищет ожидающие сообщения и отправляет их.
+        Асинхронный бесконечный цикл, который периодически одним запросом извлекает
+        все ожидающие сообщения активных пользователей и отправляет их.
+
+        Сообщения группируются по пользователю: за один тик пользователю отправляется
+        только первое (самое раннее) ожидающее сообщение. Отправки выполняются
+        конкурентно через asyncio.gather под семафором. Пауза между тиками
+        рассчитывается адаптивно по времени ближайшего ожидающего сообщения.
         После успешной отправки сообщения, обновляет статус сообщения на 'sent'.
         Если сообщение является последним в цепочке, обновляет статус пользователя на 'finished'.
     """
     while True:
-        users = await UserRepository.get_all_alive()
-        if users:
-            logger.debug(f"Processing {len(users)} alive users.")
-        for user in users:
-            message_to_send = await SentMessageRepository.fetch_pending(user.user_id)
-            logger.debug(f"Found {message_to_send} messages to send for user {user.user_id}.")
-            if message_to_send:
-                await send_message(user.user_id, message_to_send.message_text)
-                await SentMessageRepository.update_status(
-                        user.user_id, message_to_send.index, is_sent=True, is_available_sent=True
-                )
-                logger.info(
-                        f"Sent message index {message_to_send.index} to user {user.user_id},"
-                        f" message_text: {message_to_send.message_text}")
-                if message_to_send.index == 3:
-                    await UserRepository.update_user(UserSchema(user_id=user.user_id, status=Status.finished.value))
-                    logger.info(f"User {user.user_id} finished.")
-            else:
-                logger.debug(f"No messages to send for user {user.user_id} at this time.")
-        
-        await asyncio.sleep(10)
-
-
-async def get_or_add_user_in_db(user_id: int) -> UserSchema:
-    """
-        Асинхронно проверяет наличие пользователя в базе данных по его id.
-        Если пользователь найден, возвращает его данные. В противном случае создает нового пользователя
-        с указанным id и добавляет начальные сообщения для него.
-    
+        async with AsyncSessionLocal() as session:  # Одна сессия на выборку тика
+            if _alive_cache_ts is None or time.monotonic() - _alive_cache_ts > ALIVE_CACHE_TTL:
+                await _refresh_alive_cache(session=session)
+            messages_to_send = await SentMessageRepository.fetch_all_pending(session=session)
+        if messages_to_send:
+            logger.debug("Processing {} pending messages.", len(messages_to_send))
+        processed_users: set[int] = set()
+        tasks = []
+        for user_id, index, message_text in messages_to_send:
+            if user_id not in _alive_cache or user_id in processed_users:
+                continue  # За один тик отправляем пользователю только первое сообщение
+            processed_users.add(user_id)
+            tasks.append(_dispatch_message(user_id, index, message_text))
+        if tasks:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"An error occurred while dispatching a message: {result}")
+
+        next_due = await SentMessageRepository.next_due_at()
+        if next_due is None:
+            sleep_seconds = MAX_TICK_SLEEP
+        else:
+            sleep_seconds = min(MAX_TICK_SLEEP,
+                                max(MIN_TICK_SLEEP, (next_due - utcnow()).total_seconds()))
+        await asyncio.sleep(sleep_seconds)
+
+
+async def get_or_add_user_in_db(user_id: int) -> None:
+    """
+        Асинхронно гарантирует наличие пользователя в базе данных по его id.
+
+        Проверка существования выполняется самим INSERT ... ON CONFLICT DO NOTHING
+        (add_user_raw), без предварительного SELECT и построения Pydantic-схем:
+        вызывающей стороне результат не нужен.
+
         Параметры:
         - user_id (int): id пользователя для поиска или добавления.
-    
-        Возвращает:
-        - UserSchema: Схема данных пользователя.
-    
+
         В случае возникновения исключения при добавлении нового пользователя, логгирует ошибку.
     """
     try:
-        user = await UserRepository.get_by_user_id(user_id)
-        if not user:
-            user = await UserRepository.add_user(UserSchema(user_id=user_id))
-            await add_initial_messages_for_user(user_id)
-            logger.debug(f"New user {user_id} added and initialized.")  # Сокращаем количество логов
-        return user
+        async with AsyncSessionLocal() as session:  # Одна сессия на добавление пользователя и сообщений
+            inserted = await UserRepository.add_user_raw(user_id, session=session)
+            if inserted:
+                await add_initial_messages_for_user(user_id, session=session)
+                _alive_cache.add(user_id)
+                logger.debug("New user {} added and initialized.", user_id)  # Сокращаем количество логов
     except Exception as e:
         logger.error(f"An error occurred while processing user {user_id}: {e}")
 
 
-async def add_initial_messages_for_user(user_id: int):
+async def add_initial_messages_for_user(user_id: int, session=None):
     """
         Асинхронно добавляет начальные сообщения для нового пользователя в базу данных.
     
         Параметры:
         - user_id (int): id пользователя, для которого добавляются начальные сообщения.
+        - session (AsyncSession | None): Внешняя сессия БД или None.
     
-        Для каждого сообщения из предопределенного списка MESSAGES вычисляет время отправки,
-        добавляет сообщение в базу данных, где is_sent = False.
+        Для каждого сообщения из предопределенного списка MESSAGES вычисляет время отправки
+        и добавляет весь набор в базу данных одной транзакцией, где is_sent = False.
     """
-    now = datetime.utcnow()
+    now = utcnow()
     try:
-        for message in MESSAGES:
-            index = message["index"]
-            delay = message["delay"]
-            text = message["text"]
-            
-            sent_message = SentMessage(
+        sent_messages = [
+            SentMessage(
                     user_id=user_id,
-                    message_text=text,
-                    index=index,
-                    sent_at=now + delay,
+                    message_text=message.text,
+                    index=message.index,
+                    sent_at=now + message.delay,
                     is_available_sent=True,
                     is_sent=False
             )
-            await SentMessageRepository.add_message(sent_message)
-            logger.debug(f"Initial message {index} added for user {user_id}.")
+            for message in MESSAGES
+        ]
+        await SentMessageRepository.add_messages_bulk(sent_messages, session=session)
+        logger.debug("Initial messages added for user {}.", user_id)
     except Exception as e:
         logger.error(f"An error occurred while adding initial messages for user {user_id}: {e}")
 
@@ -141,14 +236,14 @@ async def message_handler(client: Client, message: Message):
         если они присутствуют в тексте сообщения.
     """
     user_id = message.from_user.id
-    logger.debug(f"User {user_id} sent a message: {message.text}")
+    logger.debug("User {} sent a message: {}", user_id, message.text)
     if not message.outgoing:
         await get_or_add_user_in_db(user_id)
     else:
         user = await UserRepository.get_by_user_id(message.chat.id)
-        logger.debug(f"User {user} found in the database.")
-        if user and user.status == Status.alive.value:
-            logger.debug(f"User {user_id} is alive.")
+        logger.debug("User {} found in the database.", user)
+        if user and user.status == ALIVE:
+            logger.debug("User {} is alive.", user_id)
             await handle_trigger_for_user(user.user_id, message.text)
 
 
@@ -160,13 +255,13 @@ async def handle_trigger_for_user(user_id: int, text: str):
         - user_id (int): id пользователя, отправившего сообщение.
         - text (str): Текст сообщения для анализа на наличие триггеров.
     
-        Если в тексте сообщения есть одно из триггерных слов, то
+        Если в тексте сообщения есть одно из триггерных слов (TRIGGER_RE), то
         помечаем сообщение с индексом 2 в базе данных как недоступное.
     """
-    if any(trigger_word in text for trigger_word in TRIGGER_WORDS):
+    if TRIGGER_RE.search(text):
         try:
             await SentMessageRepository.mark_unavailable(user_id, 2)
-            event_time = datetime.utcnow() + MESSAGES[2]["delay"]
+            event_time = utcnow() + THIRD_DELAY
             await SentMessageRepository.update_third_message_time(SentMessageSchema(user_id=user_id, index=2, sent_at=event_time))
             logger.info(f"Trigger processed for user {user_id}.")
         except Exception as e:
@@ -1,7 +1,9 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.utils import utcnow
 
 
 class SentMessageSchema(BaseModel):
@@ -26,13 +28,14 @@ class SentMessageSchema(BaseModel):
     index: int
     user_id: int
     message_text: Optional[str]
-    sent_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = Field(default_factory=utcnow)
     is_available_sent: Optional[bool]
     is_sent: Optional[bool]
     
-    class Config:
-        arbitrary_types_allowed = True
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat(),  # Конвертация datetime в ISO формат
-        }
+    model_config = ConfigDict(
+            arbitrary_types_allowed=True,
+            from_attributes=True,
+            json_encoders={
+                datetime: lambda v: v.isoformat(),  # Конвертация datetime в ISO формат
+            },
+    )
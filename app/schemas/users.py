@@ -1,7 +1,9 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.utils import utcnow
 
 
 class UserSchema(BaseModel):
@@ -21,13 +23,14 @@ class UserSchema(BaseModel):
     """
     
     user_id: int
-    created_at: Optional[datetime] = Field(default=datetime.utcnow())
+    created_at: Optional[datetime] = Field(default_factory=utcnow)
     status: str = Field(default='alive')
-    status_updated_at: Optional[datetime] = Field(default=datetime.utcnow())
+    status_updated_at: Optional[datetime] = Field(default_factory=utcnow)
     
-    class Config:
-        arbitrary_types_allowed = True
-        from_attributes = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat(),  # Конвертация datetime в ISO формат
-        }
+    model_config = ConfigDict(
+            arbitrary_types_allowed=True,
+            from_attributes=True,
+            json_encoders={
+                datetime: lambda v: v.isoformat(),  # Конвертация datetime в ISO формат
+            },
+    )
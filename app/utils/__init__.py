@@ -0,0 +1,45 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+
+def utcnow() -> datetime:
+    """
+        Возвращает текущее время UTC без tzinfo (naive).
+
+        Замена устаревшего datetime.utcnow(): совместима с naive-колонками DateTime в моделях.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TokenBucket:
+    """
+        Простой асинхронный token bucket для ограничения частоты исходящих запросов.
+
+        Атрибуты:
+        - rate (float): Количество токенов, пополняемых в секунду.
+        - capacity (float): Максимальный запас токенов. По умолчанию равен rate.
+
+        Метод acquire() ждет, пока не накопится хотя бы один токен, и забирает его.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+            Асинхронно ожидает появления свободного токена и забирает его.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
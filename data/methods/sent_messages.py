@@ -1,16 +1,18 @@
 from datetime import datetime
 
-from sqlalchemy import select
+from sqlalchemy import func, select, update
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.logger import logger
+from app.utils import utcnow
 from app.schemas.sent_messages import SentMessageSchema
-from data.models.models import AsyncSessionLocal, SentMessage
+from data.models.models import SentMessage, session_scope
 
 
 class SentMessageRepository:
     @staticmethod
-    async def add_message(message_data: SentMessage) -> bool:
+    async def add_message(message_data: SentMessage, session: AsyncSession | None = None) -> bool:
         """
             Асинхронно добавляет новое сообщение в базу данных.
     
@@ -21,7 +23,7 @@ class SentMessageRepository:
             - bool: True, если сообщение успешно добавлено, иначе False.
         """
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 session.add(message_data)
                 await session.commit()
                 return True
@@ -29,9 +31,29 @@ class SentMessageRepository:
             logger.error(f"An error occurred while adding a new message: {e}")
             return False
     
+    @staticmethod
+    async def add_messages_bulk(messages: list[SentMessage], session: AsyncSession | None = None) -> bool:
+        """
+            Асинхронно добавляет несколько сообщений в базу данных одной транзакцией.
+
+            Параметры:
+            - messages (list[SentMessage]): Список сообщений для добавления.
+
+            Возвращает:
+            - bool: True, если сообщения успешно добавлены, иначе False.
+        """
+        try:
+            async with session_scope(session) as session:
+                session.add_all(messages)
+                await session.commit()
+                return True
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while adding messages in bulk: {e}")
+            return False
+
     @staticmethod
     async def update_status(user_id: int, index: int, is_sent: bool,
-                            is_available_sent: bool) -> bool:
+                            is_available_sent: bool, session: AsyncSession | None = None) -> bool:
         """
             Асинхронно обновляет статус отправленного сообщения.
 
@@ -45,18 +67,16 @@ class SentMessageRepository:
             - bool: True, если статус сообщения успешно обновлен, иначе False.
         """
         try:
-            async with AsyncSessionLocal() as session:
-                # Находим сообщение по user_id и index
+            async with session_scope(session) as session:
                 result = await session.execute(
-                        select(SentMessage)
+                        update(SentMessage)
                         .where(SentMessage.user_id == user_id, SentMessage.index == index)
+                        .values(is_sent=is_sent, is_available_sent=is_available_sent)
+                        .execution_options(synchronize_session=False)
                 )
-                message = result.scalars().first()
-                
-                if message:
-                    message.is_sent = is_sent
-                    message.is_available_sent = is_available_sent
-                    await session.commit()
+                await session.commit()
+
+                if result.rowcount:
                     logger.info(
                             f"Message status updated for user_id={user_id}, index={index}")
                     return True
@@ -66,7 +86,7 @@ class SentMessageRepository:
             return False
     
     @staticmethod
-    async def fetch_pending(user_id: int) -> SentMessageSchema | None:
+    async def fetch_pending(user_id: int, session: AsyncSession | None = None) -> SentMessageSchema | None:
         """
             Асинхронно извлекает ожидающее отправки сообщение для пользователя.
 
@@ -77,8 +97,8 @@ class SentMessageRepository:
             - SentMessageSchema | None: Схема ожидающего сообщения или None, если таких сообщений нет.
         """
         try:
-            async with AsyncSessionLocal() as session:
-                now = datetime.utcnow()
+            async with session_scope(session) as session:
+                now = utcnow()
                 result = await session.execute(
                         select(SentMessage)
                         .where(SentMessage.user_id == user_id,
@@ -90,7 +110,7 @@ class SentMessageRepository:
                 )
                 message = result.scalars().first()
                 if message is not None:
-                    return SentMessageSchema.from_orm(message)
+                    return SentMessageSchema.model_validate(message)
                 else:
                     return None
         except SQLAlchemyError as e:
@@ -98,7 +118,92 @@ class SentMessageRepository:
             return None
     
     @staticmethod
-    async def mark_unavailable(user_id: int, index: int) -> bool:
+    async def fetch_all_pending(session: AsyncSession | None = None) -> list[tuple[int, int, str]]:
+        """
+            Асинхронно извлекает все ожидающие отправки сообщения одним запросом.
+
+            Фильтрация по статусу пользователя выполняется вызывающей стороной по кэшу
+            активных пользователей, поэтому запрос обращается только к таблице сообщений.
+            Возвращаются только нужные горячему пути колонки, без построения Pydantic-схем.
+
+            Возвращает:
+            - list[tuple[int, int, str]]: Кортежи (user_id, index, message_text),
+              отсортированные по (user_id, sent_at).
+
+            В случае ошибки доступа к базе данных возвращает пустой список.
+        """
+        try:
+            async with session_scope(session) as session:
+                now = utcnow()
+                result = await session.execute(
+                        select(SentMessage.user_id, SentMessage.index, SentMessage.message_text)
+                        .where(SentMessage.sent_at <= now,
+                               SentMessage.is_available_sent == True,
+                               SentMessage.is_sent == False)
+                        .order_by(SentMessage.user_id, SentMessage.sent_at)
+                )
+                return [tuple(row) for row in result.all()]
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while fetching all pending messages: {e}")
+            return []
+
+    @staticmethod
+    async def next_due_at(session: AsyncSession | None = None) -> datetime | None:
+        """
+            Асинхронно извлекает ближайшее время отправки среди неотправленных доступных сообщений.
+
+            Используется циклом рассылки для адаптивного расчета паузы между тиками.
+
+            Возвращает:
+            - datetime | None: Минимальное sent_at или None, если ожидающих сообщений нет
+              или произошла ошибка.
+        """
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                        select(func.min(SentMessage.sent_at))
+                        .where(SentMessage.is_available_sent == True,
+                               SentMessage.is_sent == False)
+                )
+                return result.scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while fetching the next due time: {e}")
+            return None
+
+    @staticmethod
+    async def mark_all_unavailable(user_id: int, session: AsyncSession | None = None) -> bool:
+        """
+            Асинхронно помечает все неотправленные сообщения пользователя как недоступные.
+
+            Используется, когда пользователь выбывает из воронки (dead или finished),
+            чтобы его сообщения не попадали в выборку ожидающих.
+
+            Параметры:
+            - user_id (int): Идентификатор пользователя.
+
+            Возвращает:
+            - bool: True, если хотя бы одно сообщение помечено, иначе False.
+        """
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                        update(SentMessage)
+                        .where(SentMessage.user_id == user_id, SentMessage.is_sent == False)
+                        .values(is_available_sent=False)
+                        .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+
+                if result.rowcount:
+                    logger.debug(f"All pending messages marked as unavailable for user_id={user_id}")
+                    return True
+                return False
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while marking all messages as unavailable: {e}")
+            return False
+
+    @staticmethod
+    async def mark_unavailable(user_id: int, index: int, session: AsyncSession | None = None) -> bool:
         """
             Асинхронно помечает сообщение как недоступное для отправки.
 
@@ -110,16 +215,16 @@ class SentMessageRepository:
             - bool: True, если сообщение успешно помечено как недоступное, иначе False.
         """
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 result = await session.execute(
-                        select(SentMessage)
+                        update(SentMessage)
                         .where(SentMessage.user_id == user_id, SentMessage.index == index)
+                        .values(is_available_sent=False)
+                        .execution_options(synchronize_session=False)
                 )
-                message = result.scalars().first()
-                
-                if message:
-                    message.is_available_sent = False
-                    await session.commit()
+                await session.commit()
+
+                if result.rowcount:
                     logger.debug(f"Message marked as unavailable for user_id={user_id}, index={index}")
                     return True
                 return False
@@ -128,7 +233,7 @@ class SentMessageRepository:
             return False
     
     @staticmethod
-    async def update_third_message_time(sent_message_data: SentMessageSchema) -> bool:
+    async def update_third_message_time(sent_message_data: SentMessageSchema, session: AsyncSession | None = None) -> bool:
         """
             Асинхронно обновляет время отправки третьего сообщения для пользователя.
 
@@ -139,18 +244,18 @@ class SentMessageRepository:
             - bool: True, если время отправки успешно обновлено, иначе False.
         """
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 result = await session.execute(
-                        select(SentMessage)
+                        update(SentMessage)
                         .where(SentMessage.user_id == sent_message_data.user_id, SentMessage.index == 3)
+                        .values(sent_at=sent_message_data.sent_at)
+                        .execution_options(synchronize_session=False)
                 )
-                third_message = result.scalars().first()
-                
-                if third_message:
-                    third_message.sent_at = sent_message_data.sent_at
-                    await session.commit()
+                await session.commit()
+
+                if result.rowcount:
                     logger.debug(
-                            f"Updated sent_at for the third message for user_id={sent_message_data.user_id} to {third_message.sent_at}")
+                            f"Updated sent_at for the third message for user_id={sent_message_data.user_id} to {sent_message_data.sent_at}")
                     return True
                 return False
         except SQLAlchemyError as e:
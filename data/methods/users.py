@@ -1,18 +1,28 @@
-import asyncio
 from typing import Optional, List
 
-from loguru import logger
+from cachetools import TTLCache
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.logger import logger
 from app.schemas.users import UserSchema
-from data.models.models import AsyncSessionLocal
-from data.models.models import User
+from data.models.models import User, session_scope
+
+# Колонки, допустимые к изменению через update_user; вычисляется один раз при импорте,
+# чтобы не обращаться к метаданным таблицы на каждое обновление.
+_UPDATABLE = {column.name for column in User.__table__.columns} - {'user_id', 'created_at', 'status_updated_at'}
+
+# Короткоживущий кэш пользователей для горячего пути обработчика сообщений.
+# Промахи не кэшируются: новый пользователь должен дойти до вставки.
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
 
 
 class UserRepository:
     @staticmethod
-    async def get_all() -> List[UserSchema]:
+    async def get_all(session: AsyncSession | None = None) -> List[UserSchema]:
         """
             Асинхронно извлекает всех пользователей из базы данных.
     
@@ -22,16 +32,16 @@ class UserRepository:
             В случае ошибки доступа к базе данных возвращает пустой список.
         """
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 result = await session.execute(select(User))
                 users = result.scalars().all()
-                return [UserSchema.from_orm(user) for user in users]
+                return [UserSchema.model_validate(user) for user in users]
         except SQLAlchemyError as e:
             logger.error(f"An error occurred while fetching all users: {e}")
             return []
     
     @staticmethod
-    async def get_all_alive() -> List[UserSchema]:
+    async def get_all_alive(session: AsyncSession | None = None) -> List[UserSchema]:
         """
             Асинхронно извлекает всех активных (alive) пользователей из базы данных.
 
@@ -41,16 +51,36 @@ class UserRepository:
             В случае ошибки доступа к базе данных возвращает пустой список.
         """
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 result = await session.execute(select(User).where(User.status == "alive"))
                 users = result.scalars().all()
-                return [UserSchema.from_orm(user) for user in users]
+                return [UserSchema.model_validate(user) for user in users]
         except SQLAlchemyError as e:
             logger.error(f"An error occurred while fetching all alive users: {e}")
             return []
     
     @staticmethod
-    async def add_user(user_data: UserSchema) -> Optional[UserSchema]:
+    async def get_all_alive_ids(session: AsyncSession | None = None) -> List[int]:
+        """
+            Асинхронно извлекает id всех активных (alive) пользователей без построения Pydantic-схем.
+
+            Предназначен для горячего пути рассылки, где нужны только идентификаторы.
+
+            Возвращает:
+            - List[int]: Список id активных пользователей.
+
+            В случае ошибки доступа к базе данных возвращает пустой список.
+        """
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(select(User.user_id).where(User.status == "alive"))
+                return list(result.scalars().all())
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while fetching alive user ids: {e}")
+            return []
+
+    @staticmethod
+    async def add_user(user_data: UserSchema, session: AsyncSession | None = None) -> Optional[UserSchema]:
         """
            Асинхронно добавляет нового пользователя в базу данных.
 
@@ -61,18 +91,49 @@ class UserRepository:
            - Optional[UserSchema]: Схема добавленного пользователя или None в случае ошибки.
        """
         try:
-            async with AsyncSessionLocal() as session:
-                new_user = User(**user_data.dict(exclude_unset=True))
+            async with session_scope(session) as session:
+                new_user = User(**user_data.model_dump(exclude_unset=True))
                 session.add(new_user)
                 await session.commit()
                 await session.refresh(new_user)
-                return UserSchema.from_orm(new_user)
+                _user_cache.pop(user_data.user_id, None)
+                return UserSchema.model_validate(new_user)
         except SQLAlchemyError as e:
             logger.error(f"An error occurred while adding a new user: {e}")
             return None
     
     @staticmethod
-    async def get_by_user_id(user_id: int) -> Optional[UserSchema]:
+    async def add_user_raw(user_id: int, session: AsyncSession | None = None) -> bool:
+        """
+            Асинхронно добавляет пользователя одним запросом INSERT ... ON CONFLICT DO NOTHING.
+
+            Предварительный SELECT не нужен: если пользователь уже существует,
+            вставка молча пропускается. Остальные поля заполняются значениями по умолчанию из БД.
+
+            Параметры:
+            - user_id (int): id пользователя для добавления.
+
+            Возвращает:
+            - bool: True, если пользователь был вставлен, False, если уже существовал
+              или произошла ошибка.
+        """
+        try:
+            async with session_scope(session) as session:
+                result = await session.execute(
+                        pg_insert(User)
+                        .values(user_id=user_id)
+                        .on_conflict_do_nothing(index_elements=['user_id'])
+                        .returning(User.user_id)
+                )
+                await session.commit()
+                _user_cache.pop(user_id, None)
+                return result.scalar() is not None
+        except SQLAlchemyError as e:
+            logger.error(f"An error occurred while upserting user {user_id}: {e}")
+            return False
+
+    @staticmethod
+    async def get_by_user_id(user_id: int, session: AsyncSession | None = None) -> Optional[UserSchema]:
         """
             Асинхронно извлекает пользователя по его идентификатору.
 
@@ -81,19 +142,27 @@ class UserRepository:
 
             Возвращает:
             - Optional[UserSchema]: Схема пользователя, если он найден, иначе None.
+
+            Результат кэшируется на короткое время (TTL), чтобы частые сообщения одного
+            пользователя не порождали SELECT на каждое. Кэш сбрасывается при изменении данных.
         """
+        cached = _user_cache.get(user_id)
+        if cached is not None:
+            return cached
         try:
-            async with AsyncSessionLocal() as session:
+            async with session_scope(session) as session:
                 result = await session.execute(select(User).where(User.user_id == user_id))
                 user = result.scalars().first()
                 if user:
-                    return UserSchema.from_orm(user)
+                    user_schema = UserSchema.model_validate(user)
+                    _user_cache[user_id] = user_schema
+                    return user_schema
         except SQLAlchemyError as e:
             logger.error(f"An error occurred while fetching user by user_id: {e}")
             return None
     
     @staticmethod
-    async def update_user(update_data: UserSchema) -> UserSchema | None:
+    async def update_user(update_data: UserSchema, session: AsyncSession | None = None) -> bool:
         """
             Асинхронно обновляет данные пользователя в базе данных.
         
@@ -101,22 +170,24 @@ class UserRepository:
             - update_data (UserSchema): Схема пользователя с обновленными данными.
         
             Возвращает:
-            - UserSchema | None: Схема обновленного пользователя или None в случае ошибки.
-        
+            - bool: True, если пользователь найден и обновлен, иначе False.
+              Актуальные данные строки при необходимости следует запрашивать через get_by_user_id.
+
             Примечание:
             - Поля 'created_at' и 'status_updated_at' исключаются из обновления для сохранения их исходных значений.
         """
         try:
-            async with AsyncSessionLocal() as session:
-                result = await session.execute(select(User).where(User.user_id == update_data.user_id))
-                user_to_update = result.scalars().first()
-                if user_to_update:
-                    for key, value in update_data.model_dump().items():
-                        if hasattr(user_to_update, key) and key not in ['created_at', "status_updated_at"]:
-                            setattr(user_to_update, key, value)
-                    await session.commit()
-                    return UserSchema.from_orm(user_to_update)
-            return None
+            async with session_scope(session) as session:
+                values = update_data.model_dump(include=_UPDATABLE)
+                result = await session.execute(
+                        update(User)
+                        .where(User.user_id == update_data.user_id)
+                        .values(**values)
+                        .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+                _user_cache.pop(update_data.user_id, None)
+                return bool(result.rowcount)
         except SQLAlchemyError as e:
             logger.error(f"An error occurred while updating user: {e}")
-            return None
+            return False
@@ -1,12 +1,13 @@
 import asyncio
-from datetime import datetime
+from contextlib import asynccontextmanager
 
-from sqlalchemy import Column, DateTime, String, BigInteger, Boolean, ForeignKey, Integer
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import Column, DateTime, String, BigInteger, Boolean, ForeignKey, Index, Integer, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship
 
 from app.logger import logger
-from config import DATABASE_URL
+from app.utils import utcnow
+from config import DATABASE_URL, DROP_TABLES
 
 Base = declarative_base()
 
@@ -23,20 +24,26 @@ class User(Base):
 
         Связи:
         - sent_messages: Связь с моделью отправленных сообщений.
+
+        Индексы:
+        - ix_users_alive: Частичный индекс по активным пользователям для выборок горячего пути.
     """
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_alive', 'user_id', postgresql_where=text("status = 'alive'")),
+    )
     user_id = Column(BigInteger,
                      primary_key=True)
     created_at = Column(DateTime,
-                        default=datetime.utcnow,
+                        default=utcnow,
                         nullable=False)  # TODO: Нужно учесть часовой пояс России
     status = Column(String,
                     nullable=False,
                     default='alive')
     status_updated_at = Column(DateTime,
                                nullable=False,
-                               default=datetime.utcnow,
-                               onupdate=datetime.utcnow)
+                               default=utcnow,
+                               onupdate=utcnow)
     sent_messages = relationship("SentMessage", back_populates="user")
     
     def __repr__(self):
@@ -58,8 +65,16 @@ class SentMessage(Base):
         
             Связи:
             - user: Связь с моделью пользователя.
+
+            Индексы:
+            - ix_sent_pending: Частичный индекс по неотправленным доступным сообщениям,
+              соответствует предикатам выборки ожидающих сообщений.
     """
     __tablename__ = 'sent_messages'
+    __table_args__ = (
+        Index('ix_sent_pending', 'user_id', 'sent_at',
+              postgresql_where=text("is_sent = false AND is_available_sent = true")),
+    )
     sent_messages_id = Column(Integer, primary_key=True)
     index = Column(Integer, nullable=False)
     user_id = Column(BigInteger, ForeignKey('users.user_id'), nullable=False)
@@ -78,19 +93,47 @@ class SentMessage(Base):
 engine = create_async_engine(
         DATABASE_URL,
         echo=False,  # DEBUG  # включает логирование SQL-запросов (для отладки).
-        pool_size=10,  # Минимальное количество соединений в пуле
-        max_overflow=50  # Максимальное количество соединений в пуле
+        pool_size=5,  # Минимальное количество соединений в пуле
+        max_overflow=10,  # Максимальное количество дополнительных соединений сверх пула
+        pool_pre_ping=True,  # Проверка соединения перед выдачей из пула (защита от протухших)
+        pool_recycle=1800,  # Пересоздание соединений старше 30 минут
+        pool_timeout=10  # Максимальное время ожидания свободного соединения, сек
 )
-AsyncSessionLocal = sessionmaker(  # noqa
+AsyncSessionLocal = async_sessionmaker(
         bind=engine,
-        class_=AsyncSession,
         expire_on_commit=False
 )
 
 
+@asynccontextmanager
+async def session_scope(session: AsyncSession | None = None):
+    """
+        Асинхронный контекстный менеджер для работы с сессией.
+
+        Если сессия передана извне (например, одна сессия на весь тик рассылки),
+        использует её без закрытия. Иначе открывает новую сессию из AsyncSessionLocal.
+
+        Параметры:
+        - session (AsyncSession | None): Внешняя сессия или None.
+    """
+    if session is not None:
+        yield session
+    else:
+        async with AsyncSessionLocal() as new_session:
+            yield new_session
+
+
 async def create_tables():
+    """
+        Создает таблицы по метаданным моделей.
+
+        Удаление существующих таблиц выполняется только при явно выставленной
+        переменной окружения DROP_TABLES=1, чтобы случайный запуск не уничтожил данные.
+    """
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all, checkfirst=True)  # DEBUG MODE/ # TODO: удалить после отладки
+        if DROP_TABLES:
+            await conn.run_sync(Base.metadata.drop_all, checkfirst=True)
+            logger.warning('Existing tables dropped (DROP_TABLES=1)')
         await conn.run_sync(Base.metadata.create_all, checkfirst=True)
         logger.info('Tables created')
 